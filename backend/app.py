@@ -1,23 +1,83 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-import os
+import asyncio
 import json
+import logging
+import orjson
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from pdf_extractor import extract_text_from_pdf, clean_and_segment_text
-from question_generator import generate_quiz, evaluate_saq_answer
-from database import QuizHistory
+from pdf_extractor import extract_text_from_pdf_stream, clean_and_segment_text, count_words
+from question_generator import generate_quiz, evaluate_saq_answer, evaluate_saq_batch, run_sync, iter_sync
+from database import SQLiteQuizHistory, QuizCache
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson (much faster than stdlib json)"""
+    
+    def dumps(self, obj, **kwargs):
+        # orjson always emits compact output; indent/sort kwargs are ignored
+        return orjson.dumps(
+            obj,
+            default=self.default,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        ).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+def parse_json(req):
+    """
+    Decode a JSON request body with orjson
+    
+    Reads the raw body once without caching it on the request, so large
+    text/segments payloads are not held twice in memory.
+    
+    Returns:
+        Decoded JSON, or None if the request has no JSON body
+    """
+    if not req.is_json:
+        return None
+    
+    body = req.get_data(cache=False)
+    if not body:
+        return None
+    
+    return orjson.loads(body)
+
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s %(levelname)s %(name)s: %(message)s'
+)
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+app.json.sort_keys = False
+app.json.compact = True
 CORS(app)
 
 # Configuration
-UPLOAD_FOLDER = 'uploads'
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
+# Shared pool for blocking PDF extraction / segmentation work
+EXECUTOR = ThreadPoolExecutor(max_workers=4)
+
 # Initialize database
-quiz_history = QuizHistory()
+quiz_history = SQLiteQuizHistory()
+
+# Identical generation requests are served from cache for an hour
+quiz_cache = QuizCache(ttl=3600)
+
+
+def generate_quiz_sync(text, segments, preferences):
+    """Blocking wrapper around the async quiz generator"""
+    return run_sync(generate_quiz(text, segments, preferences))
+
+
+generate_quiz_cached = quiz_cache.cached(generate_quiz_sync)
 
 
 @app.route('/health', methods=['GET'])
@@ -30,12 +90,14 @@ def health_check():
 
 
 @app.route('/upload-notes', methods=['POST'])
-def upload_notes():
+async def upload_notes():
     """
     Upload PDF file(s) or raw text
     Returns: extracted text, topics, and segments
     """
     try:
+        loop = asyncio.get_running_loop()
+        
         # Handle PDF file upload
         if 'file' in request.files:
             file = request.files['file']
@@ -46,34 +108,28 @@ def upload_notes():
             if not file.filename.endswith('.pdf'):
                 return jsonify({'error': 'Only PDF files are supported'}), 400
             
-            # Save file temporarily
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-            file.save(filepath)
-            
-            # Extract text from PDF
-            raw_text = extract_text_from_pdf(filepath)
-            
-            # Clean up file after extraction
-            os.remove(filepath)
+            # Extract text straight from the upload, without a temp file
+            raw_text = await loop.run_in_executor(EXECUTOR, extract_text_from_pdf_stream, file.stream)
             
         # Handle raw text input
-        elif request.json and 'text' in request.json:
-            raw_text = request.json['text']
         else:
-            return jsonify({'error': 'No file or text provided'}), 400
+            data = parse_json(request)
+            if not data or 'text' not in data:
+                return jsonify({'error': 'No file or text provided'}), 400
+            raw_text = data['text']
         
         # Clean and segment the text
-        segments = clean_and_segment_text(raw_text)
+        segments = await loop.run_in_executor(EXECUTOR, clean_and_segment_text, raw_text)
         
-        # Extract topics from segments
-        topics = [seg['heading'] for seg in segments if seg['heading']]
+        # Extract unique topics from segments, keeping document order
+        topics = list(dict.fromkeys(seg['heading'] for seg in segments if seg.get('heading')))
         
         return jsonify({
             'success': True,
             'raw_text': raw_text[:500] + '...' if len(raw_text) > 500 else raw_text,
             'segments': segments,
             'topics': topics,
-            'word_count': len(raw_text.split())
+            'word_count': count_words(raw_text)
         })
         
     except Exception as e:
@@ -97,23 +153,25 @@ def generate_quiz_endpoint():
             "saq_answer_style": "full",  // keywords, full
             "include_hints": true,
             "include_section_refs": true
-        }
+        },
+        "nonce": "..."  // optional, bypasses the quiz cache
     }
     """
     try:
-        data = request.json
+        data = parse_json(request)
         text = data.get('text', '')
         segments = data.get('segments', [])
         preferences = data.get('preferences', {})
+        nonce = data.get('nonce')
         
         if not text and not segments:
             return jsonify({'error': 'No content provided'}), 400
         
-        # Generate quiz using AI
-        quiz_data = generate_quiz(text, segments, preferences)
+        # Generate quiz using AI (cached for identical inputs)
+        quiz_data = generate_quiz_cached(text, segments, preferences, nonce=nonce)
         
-        # Save to history
-        quiz_id = quiz_history.save_quiz(quiz_data, preferences)
+        # Save to history, with the input kept for statistics and regeneration
+        quiz_id = quiz_history.save_quiz({**quiz_data, 'text': text, 'segments': segments}, preferences)
         quiz_data['quiz_id'] = quiz_id
         
         return jsonify({
@@ -125,6 +183,46 @@ def generate_quiz_endpoint():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/generate-quiz/stream', methods=['POST'])
+def generate_quiz_stream_endpoint():
+    """
+    Generate a quiz, streaming questions as newline-delimited JSON
+    
+    Takes the same input as /generate-quiz. Each line is either
+    {"type": "question", "question": {...}} or, once all questions are
+    sent, {"type": "done", "quiz_id": ..., "total_questions": ...}
+    """
+    try:
+        data = parse_json(request)
+        text = data.get('text', '')
+        segments = data.get('segments', [])
+        preferences = data.get('preferences', {})
+        
+        if not text and not segments:
+            return jsonify({'error': 'No content provided'}), 400
+        
+        quiz_data = run_sync(generate_quiz(text, segments, preferences, stream=True))
+        questions_iter = quiz_data.pop('questions_iter')
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    
+    def events():
+        questions = []
+        for question in iter_sync(questions_iter):
+            questions.append(question)
+            yield orjson.dumps({'type': 'question', 'question': question}) + b'\n'
+        
+        # Save the complete quiz to history once streaming finishes
+        quiz_data['questions'] = questions
+        quiz_data['total_questions'] = len(questions)
+        quiz_data['preferences'] = preferences
+        quiz_id = quiz_history.save_quiz({**quiz_data, 'text': text, 'segments': segments}, preferences)
+        yield orjson.dumps({'type': 'done', 'quiz_id': quiz_id, 'total_questions': len(questions)}) + b'\n'
+    
+    return Response(events(), mimetype='application/x-ndjson')
+
+
 @app.route('/evaluate-answer', methods=['POST'])
 def evaluate_answer():
     """
@@ -134,16 +232,18 @@ def evaluate_answer():
     {
         "user_answer": "...",
         "model_answer": "...",
-        "keywords": [...]
+        "keywords": [...],
+        "similarity_threshold": 0.98  // optional, stricter reuse of cached gradings (minimum 0.95)
     }
     """
     try:
-        data = request.json
+        data = parse_json(request)
         user_answer = data.get('user_answer', '')
         model_answer = data.get('model_answer', '')
         keywords = data.get('keywords', [])
+        similarity_threshold = data.get('similarity_threshold')
         
-        evaluation = evaluate_saq_answer(user_answer, model_answer, keywords)
+        evaluation = run_sync(evaluate_saq_answer(user_answer, model_answer, keywords, similarity_threshold))
         
         return jsonify({
             'success': True,
@@ -154,6 +254,33 @@ def evaluate_answer():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/evaluate-answers', methods=['POST'])
+def evaluate_answers():
+    """
+    Evaluate several SAQ answers concurrently
+    
+    Expected input:
+    {
+        "answers": [
+            {"user_answer": "...", "model_answer": "...", "keywords": [...]}
+        ]
+    }
+    """
+    try:
+        data = parse_json(request)
+        answers = data.get('answers', [])
+        
+        evaluations = run_sync(evaluate_saq_batch(answers))
+        
+        return jsonify({
+            'success': True,
+            'evaluations': evaluations
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/history', methods=['GET'])
 def get_history():
     """Get quiz history"""
@@ -190,12 +317,15 @@ def regenerate_quiz():
     
     Expected input:
     {
-        "quiz_id": "..."
+        "quiz_id": "...",
+        "nonce": "..."  // optional; a fresh one is used if omitted
     }
     """
     try:
-        data = request.json
+        data = parse_json(request)
         quiz_id = data.get('quiz_id')
+        # Regenerating asks for new questions, so skip the cached quiz
+        nonce = data.get('nonce') or uuid.uuid4().hex
         
         if not quiz_id:
             return jsonify({'error': 'Quiz ID required'}), 400
@@ -206,12 +336,16 @@ def regenerate_quiz():
             return jsonify({'error': 'Quiz not found'}), 404
         
         # Regenerate with same parameters
-        text = original_quiz.get('text', '')
-        segments = original_quiz.get('segments', [])
+        original_data = original_quiz.get('quiz_data', {})
+        text = original_data.get('text', '')
+        segments = original_data.get('segments', [])
         preferences = original_quiz.get('preferences', {})
         
-        new_quiz = generate_quiz(text, segments, preferences)
-        new_quiz_id = quiz_history.save_quiz(new_quiz, preferences)
+        if not text and not segments:
+            return jsonify({'error': 'Original quiz content not available'}), 400
+        
+        new_quiz = generate_quiz_cached(text, segments, preferences, nonce=nonce)
+        new_quiz_id = quiz_history.save_quiz({**new_quiz, 'text': text, 'segments': segments}, preferences)
         new_quiz['quiz_id'] = new_quiz_id
         
         return jsonify({
@@ -1,33 +1,50 @@
 """
 Database Module
-Handles quiz history storage using JSON file (simple prototype)
-Can be easily upgraded to SQLite or PostgreSQL later
+Handles quiz history storage using SQLite (default) or a JSON file
 """
 
-import json
+import atexit
+import functools
+import hashlib
+import orjson
 import os
+import threading
+import time
 from datetime import datetime
 import uuid
 
 
 class QuizHistory:
-    """Simple JSON-based storage for quiz history"""
+    """
+    Simple JSON-based storage for quiz history
     
-    def __init__(self, storage_file='quiz_history.json'):
+    The history is loaded once and kept in memory; writes mark it dirty and
+    are flushed to disk at most once per flush_delay seconds.
+    """
+    
+    def __init__(self, storage_file='quiz_history.json', flush_delay=1.0):
         self.storage_file = storage_file
+        self.flush_delay = flush_delay
+        self._lock = threading.RLock()
+        self._flush_timer = None
         self._ensure_storage_exists()
+        self._data = self._load_data()
+        # Quiz records by ID for O(1) lookups
+        self._index = {quiz['id']: quiz for quiz in self._data['quizzes']}
+        # Don't lose a pending write on shutdown
+        atexit.register(self.flush)
     
     def _ensure_storage_exists(self):
         """Create storage file if it doesn't exist"""
         if not os.path.exists(self.storage_file):
-            with open(self.storage_file, 'w') as f:
-                json.dump({'quizzes': []}, f)
+            with open(self.storage_file, 'wb') as f:
+                f.write(orjson.dumps({'quizzes': []}))
     
     def _load_data(self):
         """Load data from storage file"""
         try:
-            with open(self.storage_file, 'r') as f:
-                return json.load(f)
+            with open(self.storage_file, 'rb') as f:
+                return orjson.loads(f.read())
         except Exception as e:
             print(f"Error loading data: {e}")
             return {'quizzes': []}
@@ -35,11 +52,28 @@ class QuizHistory:
     def _save_data(self, data):
         """Save data to storage file"""
         try:
-            with open(self.storage_file, 'w') as f:
-                json.dump(data, f, indent=2)
+            with open(self.storage_file, 'wb') as f:
+                f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
         except Exception as e:
             print(f"Error saving data: {e}")
     
+    def _schedule_save(self):
+        """Schedule a debounced flush of the in-memory data to disk"""
+        with self._lock:
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.flush_delay, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+    
+    def flush(self):
+        """Write pending changes to disk immediately"""
+        with self._lock:
+            if self._flush_timer is None:
+                return
+            self._flush_timer.cancel()
+            self._flush_timer = None
+            self._save_data(self._data)
+    
     def save_quiz(self, quiz_data, preferences):
         """
         Save a quiz to history
@@ -51,8 +85,6 @@ class QuizHistory:
         Returns:
             Quiz ID (string)
         """
-        data = self._load_data()
-        
         # Generate unique ID
         quiz_id = str(uuid.uuid4())
         
@@ -65,25 +97,22 @@ class QuizHistory:
             'results': None  # Will be updated when quiz is completed
         }
         
-        data['quizzes'].append(quiz_record)
-        self._save_data(data)
+        with self._lock:
+            self._data['quizzes'].append(quiz_record)
+            self._index[quiz_id] = quiz_record
+            self._schedule_save()
         
         return quiz_id
     
     def get_by_id(self, quiz_id):
         """Get a specific quiz by ID"""
-        data = self._load_data()
-        
-        for quiz in data['quizzes']:
-            if quiz['id'] == quiz_id:
-                return quiz
-        
-        return None
+        with self._lock:
+            return self._index.get(quiz_id)
     
     def get_all(self):
         """Get all quizzes"""
-        data = self._load_data()
-        return data['quizzes']
+        with self._lock:
+            return list(self._data['quizzes'])
     
     def update_results(self, quiz_id, results):
         """
@@ -101,21 +130,20 @@ class QuizHistory:
                     'completed_at': timestamp
                 }
         """
-        data = self._load_data()
-        
-        for quiz in data['quizzes']:
-            if quiz['id'] == quiz_id:
+        with self._lock:
+            quiz = self._index.get(quiz_id)
+            if quiz:
                 quiz['results'] = results
                 quiz['completed_at'] = datetime.now().isoformat()
-                break
-        
-        self._save_data(data)
+            
+            self._schedule_save()
     
     def delete_quiz(self, quiz_id):
         """Delete a quiz from history"""
-        data = self._load_data()
-        data['quizzes'] = [q for q in data['quizzes'] if q['id'] != quiz_id]
-        self._save_data(data)
+        with self._lock:
+            if self._index.pop(quiz_id, None) is not None:
+                self._data['quizzes'] = [q for q in self._data['quizzes'] if q['id'] != quiz_id]
+            self._schedule_save()
     
     def get_statistics(self):
         """
@@ -124,8 +152,7 @@ class QuizHistory:
         Returns:
             Dictionary with statistics
         """
-        data = self._load_data()
-        quizzes = data['quizzes']
+        quizzes = self.get_all()
         
         if not quizzes:
             return {
@@ -164,104 +191,252 @@ class QuizHistory:
         }
 
 
-# Optional: SQLite version for future upgrade
 class SQLiteQuizHistory:
-    """SQLite-based storage (for future use)"""
+    """
+    SQLite-based storage for quiz history (default)
+    
+    One connection is shared by all request threads; each method holds
+    the lock for its whole statement sequence, and writes commit or roll
+    back as a unit.
+    """
     
     def __init__(self, db_path='quiz_history.db'):
         import sqlite3
         self.db_path = db_path
+        self._lock = threading.RLock()
         self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        # WAL lets readers proceed while a write is in progress, and
+        # synchronous=NORMAL is safe under WAL while avoiding an fsync per commit
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
         self._create_tables()
     
     def _create_tables(self):
         """Create database tables"""
-        cursor = self.conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS quizzes (
-                id TEXT PRIMARY KEY,
-                timestamp TEXT NOT NULL,
-                quiz_data TEXT NOT NULL,
-                preferences TEXT NOT NULL,
-                results TEXT,
-                completed_at TEXT
-            )
-        ''')
-        
-        self.conn.commit()
+        with self._lock, self.conn:
+            cursor = self.conn.cursor()
+            
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS quizzes (
+                    id TEXT PRIMARY KEY,
+                    timestamp TEXT NOT NULL,
+                    quiz_data TEXT NOT NULL,
+                    preferences TEXT NOT NULL,
+                    results TEXT,
+                    completed_at TEXT
+                )
+            ''')
+            
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_quizzes_timestamp
+                ON quizzes (timestamp)
+            ''')
+    
+    @staticmethod
+    def _row_to_quiz(row):
+        """Convert a database row to a quiz record"""
+        return {
+            'id': row[0],
+            'timestamp': row[1],
+            'quiz_data': orjson.loads(row[2]),
+            'preferences': orjson.loads(row[3]),
+            'results': orjson.loads(row[4]) if row[4] else None,
+            'completed_at': row[5]
+        }
     
     def save_quiz(self, quiz_data, preferences):
         """Save quiz to database"""
-        cursor = self.conn.cursor()
         quiz_id = str(uuid.uuid4())
         timestamp = datetime.now().isoformat()
-        
-        cursor.execute('''
-            INSERT INTO quizzes (id, timestamp, quiz_data, preferences)
-            VALUES (?, ?, ?, ?)
-        ''', (
+        # Serialize before touching the database, so a failure leaves no
+        # transaction open
+        params = (
             quiz_id,
             timestamp,
-            json.dumps(quiz_data),
-            json.dumps(preferences)
-        ))
+            orjson.dumps(quiz_data).decode(),
+            orjson.dumps(preferences).decode()
+        )
+        
+        with self._lock, self.conn:
+            self.conn.execute('''
+                INSERT INTO quizzes (id, timestamp, quiz_data, preferences)
+                VALUES (?, ?, ?, ?)
+            ''', params)
         
-        self.conn.commit()
         return quiz_id
     
     def get_by_id(self, quiz_id):
         """Get quiz by ID"""
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT * FROM quizzes WHERE id = ?', (quiz_id,))
-        row = cursor.fetchone()
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT * FROM quizzes WHERE id = ?', (quiz_id,))
+            row = cursor.fetchone()
         
         if row:
-            return {
-                'id': row[0],
-                'timestamp': row[1],
-                'quiz_data': json.loads(row[2]),
-                'preferences': json.loads(row[3]),
-                'results': json.loads(row[4]) if row[4] else None,
-                'completed_at': row[5]
-            }
+            return self._row_to_quiz(row)
         
         return None
     
     def get_all(self):
         """Get all quizzes"""
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT * FROM quizzes ORDER BY timestamp DESC')
-        rows = cursor.fetchall()
-        
-        quizzes = []
-        for row in rows:
-            quizzes.append({
-                'id': row[0],
-                'timestamp': row[1],
-                'quiz_data': json.loads(row[2]),
-                'preferences': json.loads(row[3]),
-                'results': json.loads(row[4]) if row[4] else None,
-                'completed_at': row[5]
-            })
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT * FROM quizzes ORDER BY timestamp DESC')
+            rows = cursor.fetchall()
         
-        return quizzes
+        return [self._row_to_quiz(row) for row in rows]
     
     def update_results(self, quiz_id, results):
         """Update quiz results"""
-        cursor = self.conn.cursor()
         completed_at = datetime.now().isoformat()
+        params = (orjson.dumps(results).decode(), completed_at, quiz_id)
+        
+        with self._lock, self.conn:
+            self.conn.execute('''
+                UPDATE quizzes
+                SET results = ?, completed_at = ?
+                WHERE id = ?
+            ''', params)
+    
+    def delete_quiz(self, quiz_id):
+        """Delete a quiz from history"""
+        with self._lock, self.conn:
+            self.conn.execute('DELETE FROM quizzes WHERE id = ?', (quiz_id,))
+    
+    def get_statistics(self):
+        """
+        Get overall statistics
+        
+        Returns:
+            Dictionary with statistics
+        """
+        with self._lock:
+            cursor = self.conn.cursor()
+            
+            # Aggregate scores inside SQLite instead of decoding every row
+            cursor.execute('''
+                SELECT
+                    COUNT(*),
+                    COUNT(results),
+                    SUM(json_extract(results, '$.score')),
+                    SUM(json_extract(results, '$.total'))
+                FROM quizzes
+            ''')
+            total_quizzes, completed_quizzes, total_score, total_possible = cursor.fetchone()
+            
+            if not total_quizzes:
+                return {
+                    'total_quizzes': 0,
+                    'completed_quizzes': 0,
+                    'average_score': 0,
+                    'topics_studied': []
+                }
+            
+            # Extract distinct segment headings without decoding rows in Python
+            cursor.execute('''
+                SELECT DISTINCT json_extract(segment.value, '$.heading') AS heading
+                FROM quizzes, json_each(quizzes.quiz_data, '$.segments') AS segment
+                WHERE heading IS NOT NULL AND heading != ''
+            ''')
+            topics = [row[0] for row in cursor.fetchall()]
+        
+        total_score = total_score or 0
+        total_possible = total_possible or 0
+        avg_score = (total_score / total_possible * 100) if total_possible > 0 else 0
+        
+        return {
+            'total_quizzes': total_quizzes,
+            'completed_quizzes': completed_quizzes,
+            'average_score': round(avg_score, 1),
+            'topics_studied': topics
+        }
+
+
+class QuizCache:
+    """
+    SQLite-backed cache of generated quizzes
+    
+    Entries are keyed on a hash of the generation inputs, so identical
+    (text, segments, preferences) requests skip the LLM entirely.
+    """
+    
+    def __init__(self, db_path='quiz_history.db', ttl=3600):
+        import sqlite3
+        self.db_path = db_path
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self._create_tables()
+    
+    def _create_tables(self):
+        """Create database tables"""
+        with self._lock, self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS quiz_cache (
+                    key TEXT PRIMARY KEY,
+                    data BLOB NOT NULL,
+                    ts INTEGER NOT NULL
+                )
+            ''')
+    
+    @staticmethod
+    def make_key(*parts):
+        """Build a deterministic cache key from JSON-serializable inputs"""
+        return hashlib.sha256(orjson.dumps(parts, option=orjson.OPT_SORT_KEYS)).hexdigest()
+    
+    def get(self, key):
+        """Get a cached value, or None if missing or expired"""
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                'SELECT data FROM quiz_cache WHERE key = ? AND ts >= ?',
+                (key, int(time.time()) - self.ttl)
+            )
+            row = cursor.fetchone()
         
-        cursor.execute('''
-            UPDATE quizzes
-            SET results = ?, completed_at = ?
-            WHERE id = ?
-        ''', (json.dumps(results), completed_at, quiz_id))
+        return orjson.loads(row[0]) if row else None
+    
+    def set(self, key, value):
+        """Cache a value, dropping any expired entries"""
+        # Serialize first, so an unencodable value never opens a transaction
+        data = orjson.dumps(value)
+        now = int(time.time())
+        
+        with self._lock, self.conn:
+            self.conn.execute('DELETE FROM quiz_cache WHERE ts < ?', (now - self.ttl,))
+            self.conn.execute(
+                'INSERT OR REPLACE INTO quiz_cache (key, data, ts) VALUES (?, ?, ?)',
+                (key, data, now)
+            )
+    
+    def cached(self, func):
+        """
+        Decorator caching func's result on its positional arguments
+        
+        Pass nonce=... to the wrapped function to force a fresh result
+        when variation is explicitly wanted; such results are one-off and
+        not cached. Results flagged 'fallback' (degraded output after an
+        API failure) are returned but not cached either.
+        """
+        @functools.wraps(func)
+        def wrapper(*args, nonce=None):
+            if nonce is not None:
+                return func(*args)
+            
+            key = self.make_key(func.__name__, args)
+            result = self.get(key)
+            if result is None:
+                result = func(*args)
+                if not result.get('fallback'):
+                    self.set(key, result)
+            return result
         
-        self.conn.commit()
+        return wrapper
 
 
 if __name__ == "__main__":
     print("Database Module - Ready")
-    print("Using JSON file storage by default")
-    print("To use SQLite, uncomment SQLiteQuizHistory class")
+    print("Using SQLite storage by default (SQLiteQuizHistory)")
+    print("JSON file storage available via QuizHistory")
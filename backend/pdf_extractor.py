@@ -3,42 +3,145 @@ PDF Text Extraction and Segmentation Module
 Handles PDF parsing, text cleaning, and content segmentation
 """
 
+import functools
+import hashlib
+import io
+import os
 import re
+import threading
+import numpy as np
 import pdfplumber
+import pypdfium2 as pdfium
 from PyPDF2 import PdfReader
 
 
-def extract_text_from_pdf(filepath):
+# Precompiled patterns for text cleaning
+_PAGE_NUM_RE = re.compile(r'\n\s*\d+\s*\n')
+_PAGE_RE = re.compile(r'Page\s+\d+', re.IGNORECASE)
+_BLANK_RE = re.compile(r'\n\s*\n\s*\n+')
+_WS_RE = re.compile(r' +')
+_RULE_RE = re.compile(r'\n[-_=]{3,}\n')
+
+# Patterns that suggest headings, fused into one alternation so each line
+# is scanned once
+_HEADING_RE = re.compile(r'''
+    ^(?:
+        [0-9]+\.               # Numbered: "1. Introduction", "1.1 Overview"
+      | [A-Z][A-Z\s]+$         # ALL CAPS
+      | Chapter\s+\d+          # Chapter headings
+      | Section\s+\d+          # Section headings
+      | [IVX]+\.               # Roman numerals
+    )
+''', re.IGNORECASE | re.VERBOSE)
+
+_SECTION_RE = re.compile(r'^([0-9]+(?:\.[0-9]+)*)')
+
+# Pattern: "X is defined as Y" or "X is Y"
+_DEF_RE = re.compile(r'([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)\s+(?:is|are|refers to|means|defined as)\s+(.+?)(?:\.|;|\n)')
+
+# Pattern: Bullet points or numbered lists (often contain key points)
+_BULLET_RE = re.compile(r'(?:^|\n)(?:[•\-\*]|\d+\.)\s+(.+?)(?:\n|$)')
+
+# Sentence and word patterns used for segment summaries
+_SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?])\s+')
+_WORD_RE = re.compile(r'\w+')
+
+# Approximate number of words kept in each segment's summary sentences
+SUMMARY_TOKEN_BUDGET = 400
+
+# Extracted text is cached on disk keyed by the SHA-256 of the PDF bytes,
+# so re-uploading the same document skips extraction entirely
+TEXT_CACHE_DIR = 'pdf_text_cache'
+TEXT_CACHE_MAX_BYTES = 500 * 1024 * 1024  # least recently used entries evicted beyond this
+
+# PDFium is not thread-safe, so concurrent extractions (e.g. overlapping
+# uploads on the server's thread pool) take turns with it
+_PDFIUM_LOCK = threading.Lock()
+
+
+def _as_file(source):
+    """Wrap in-memory PDF bytes in a file-like object; paths pass through"""
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    return source
+
+
+def _extract_with_pdfium(source):
+    """Extract text with pypdfium2 (PDFium, fastest)"""
+    parts = []
+    with _PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(source)
+        try:
+            for page in pdf:
+                textpage = page.get_textpage()
+                # PDFium emits CRLF line endings
+                page_text = textpage.get_text_bounded().replace('\r\n', '\n')
+                textpage.close()
+                page.close()
+                if page_text:
+                    parts.append(page_text)
+                    parts.append("\n\n")
+        finally:
+            pdf.close()
+    return "".join(parts)
+
+
+def _extract_with_pdfplumber(source):
+    """Extract text with pdfplumber (slower, better table handling)"""
+    parts = []
+    with pdfplumber.open(_as_file(source)) as pdf:
+        for page in pdf.pages:
+            page_text = page.extract_text()
+            # Release the page's parsed objects; graphics-heavy pages can hold
+            # thousands of curves and rects that would otherwise accumulate
+            page.flush_cache()
+            if page_text:
+                parts.append(page_text)
+                parts.append("\n\n")
+    return "".join(parts)
+
+
+def _extract_with_pypdf2(source):
+    """Extract text with PyPDF2 (last resort)"""
+    parts = []
+    reader = PdfReader(_as_file(source))
+    for page in reader.pages:
+        page_text = page.extract_text()
+        if page_text:
+            parts.append(page_text)
+            parts.append("\n\n")
+    return "".join(parts)
+
+
+# Extraction backends, tried in order until one succeeds
+_EXTRACTORS = [
+    ('pypdfium2', _extract_with_pdfium),
+    ('pdfplumber', _extract_with_pdfplumber),
+    ('PyPDF2', _extract_with_pypdf2),
+]
+
+
+def extract_text_from_pdf(source):
     """
     Extract text from PDF file using multiple methods for robustness
     
     Args:
-        filepath: Path to PDF file
+        source: Path to PDF file, or the PDF contents as bytes
         
     Returns:
         Extracted text as string
     """
     text = ""
     
-    try:
-        # Primary method: pdfplumber (better formatting)
-        with pdfplumber.open(filepath) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n\n"
-    except Exception as e:
-        print(f"pdfplumber failed: {e}, trying PyPDF2...")
-        
-        # Fallback method: PyPDF2
+    for name, extractor in _EXTRACTORS:
         try:
-            reader = PdfReader(filepath)
-            for page in reader.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n\n"
-        except Exception as e2:
-            raise Exception(f"Failed to extract text from PDF: {e2}")
+            text = extractor(source)
+            break
+        except Exception as e:
+            print(f"{name} failed: {e}, trying next method...")
+            last_error = e
+    else:
+        raise Exception(f"Failed to extract text from PDF: {last_error}")
     
     if not text.strip():
         raise Exception("No text could be extracted from PDF. The PDF might be image-based or corrupted.")
@@ -46,6 +149,77 @@ def extract_text_from_pdf(filepath):
     return text
 
 
+def extract_text_from_pdf_stream(stream):
+    """
+    Extract text from an in-memory PDF (e.g. an uploaded file) without
+    writing it to disk
+    
+    Args:
+        stream: Readable binary file-like object containing the PDF
+        
+    Returns:
+        Extracted text as string
+    """
+    pdf_bytes = stream.read()
+    digest = hashlib.sha256(pdf_bytes).hexdigest()
+    
+    text = _read_cached_text(digest)
+    if text is None:
+        text = extract_text_from_pdf(pdf_bytes)
+        _write_cached_text(digest, text)
+    
+    return text
+
+
+def _read_cached_text(digest):
+    """Return cached text for a PDF digest, or None on a miss"""
+    path = os.path.join(TEXT_CACHE_DIR, f"{digest}.txt")
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        os.utime(path)  # mark as recently used
+        return text
+    except OSError:
+        return None
+
+
+def _write_cached_text(digest, text):
+    """Store extracted text for a PDF digest, evicting old entries if needed"""
+    try:
+        os.makedirs(TEXT_CACHE_DIR, exist_ok=True)
+        path = os.path.join(TEXT_CACHE_DIR, f"{digest}.txt")
+        # Write then rename so concurrent readers never see a partial file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+        _evict_cached_text()
+    except OSError as e:
+        print(f"Failed to cache extracted text: {e}")
+
+
+def _evict_cached_text():
+    """Delete least recently used cache entries until under TEXT_CACHE_MAX_BYTES"""
+    entries = []
+    total = 0
+    with os.scandir(TEXT_CACHE_DIR) as it:
+        for entry in it:
+            if entry.name.endswith('.txt'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+    
+    entries.sort()
+    for _, size, path in entries:
+        if total <= TEXT_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
 def clean_text(text):
     """
     Clean extracted text by removing artifacts and normalizing formatting
@@ -57,15 +231,15 @@ def clean_text(text):
         Cleaned text
     """
     # Remove page numbers (common patterns)
-    text = re.sub(r'\n\s*\d+\s*\n', '\n', text)
-    text = re.sub(r'Page\s+\d+', '', text, flags=re.IGNORECASE)
+    text = _PAGE_NUM_RE.sub('\n', text)
+    text = _PAGE_RE.sub('', text)
     
     # Remove excessive whitespace
-    text = re.sub(r'\n\s*\n\s*\n+', '\n\n', text)
-    text = re.sub(r' +', ' ', text)
+    text = _BLANK_RE.sub('\n\n', text)
+    text = _WS_RE.sub(' ', text)
     
     # Remove common header/footer artifacts
-    text = re.sub(r'\n[-_=]{3,}\n', '\n', text)
+    text = _RULE_RE.sub('\n', text)
     
     # Normalize line breaks
     text = text.strip()
@@ -73,10 +247,13 @@ def clean_text(text):
     return text
 
 
+@functools.lru_cache(maxsize=4096)
 def detect_heading(line):
     """
     Detect if a line is likely a heading/title
     
+    Cached because running headers/footers repeat on every page.
+    
     Args:
         line: Text line to analyze
         
@@ -88,19 +265,8 @@ def detect_heading(line):
     if not line:
         return False
     
-    # Patterns that suggest headings
-    heading_patterns = [
-        r'^[0-9]+\.',  # Numbered headings: "1. Introduction"
-        r'^[0-9]+\.[0-9]+',  # Sub-numbered: "1.1 Overview"
-        r'^[A-Z][A-Z\s]+$',  # ALL CAPS
-        r'^Chapter\s+\d+',  # Chapter headings
-        r'^Section\s+\d+',  # Section headings
-        r'^[IVX]+\.',  # Roman numerals
-    ]
-    
-    for pattern in heading_patterns:
-        if re.match(pattern, line, re.IGNORECASE):
-            return True
+    if _HEADING_RE.match(line):
+        return True
     
     # Short lines that are capitalized and end without punctuation
     if len(line) < 80 and line[0].isupper() and not line.endswith(('.', ',', ';')):
@@ -126,15 +292,16 @@ def clean_and_segment_text(raw_text):
     # Clean the text first
     text = clean_text(raw_text)
     
-    lines = text.split('\n')
     segments = []
     current_segment = {
         'heading': None,
-        'content': [],
+        'content': None,
         'section_number': None
     }
+    # Content of the current segment is accumulated in one growing buffer
+    buf = io.StringIO()
     
-    for line in lines:
+    for line in text.splitlines():
         line = line.strip()
         
         if not line:
@@ -143,24 +310,26 @@ def clean_and_segment_text(raw_text):
         # Check if line is a heading
         if detect_heading(line):
             # Save previous segment if it has content
-            if current_segment['content']:
-                current_segment['content'] = '\n'.join(current_segment['content'])
+            if buf.tell():
+                current_segment['content'] = buf.getvalue().rstrip('\n')
                 segments.append(current_segment)
             
             # Start new segment
-            section_match = re.match(r'^([0-9]+(?:\.[0-9]+)*)', line)
+            section_match = _SECTION_RE.match(line)
             current_segment = {
                 'heading': line,
-                'content': [],
+                'content': None,
                 'section_number': section_match.group(1) if section_match else None
             }
+            buf = io.StringIO()
         else:
             # Add to current segment content
-            current_segment['content'].append(line)
+            buf.write(line)
+            buf.write('\n')
     
     # Don't forget the last segment
-    if current_segment['content']:
-        current_segment['content'] = '\n'.join(current_segment['content'])
+    if buf.tell():
+        current_segment['content'] = buf.getvalue().rstrip('\n')
         segments.append(current_segment)
     
     # If no headings were detected, create one big segment
@@ -171,9 +340,92 @@ def clean_and_segment_text(raw_text):
             'section_number': None
         })
     
+    # Attach the most representative sentences so downstream prompts can
+    # use a compact version of long sections
+    for segment in segments:
+        segment['summary_sentences'] = summarize_segment(segment['content'])
+    
     return segments
 
 
+def summarize_segment(content, token_budget=SUMMARY_TOKEN_BUDGET):
+    """
+    Pick the most representative sentences of a segment
+    
+    Each word is weighted by how many words it co-occurs with across the
+    segment's sentences; a sentence scores the sum of its words' weights.
+    
+    Args:
+        content: Segment text
+        token_budget: Approximate number of words to keep
+        
+    Returns:
+        Top-k sentences in their original order
+    """
+    sentences = [s.strip() for s in _SENTENCE_SPLIT_RE.split(content) if s.strip()]
+    
+    # Map every word occurrence to (sentence index, word id)
+    vocab = {}
+    sentence_ids = []
+    word_ids = []
+    for index, sentence in enumerate(sentences):
+        for word in _WORD_RE.findall(sentence.lower()):
+            sentence_ids.append(index)
+            word_ids.append(vocab.setdefault(word, len(vocab)))
+    
+    if not word_ids:
+        return sentences
+    
+    avg_tokens = len(word_ids) / len(sentences)
+    k = min(len(sentences), max(5, int(token_budget // avg_tokens)))
+    if k >= len(sentences):
+        return sentences
+    
+    # Count each word once per sentence
+    pairs = np.unique(np.array(sentence_ids, dtype=np.int64) * len(vocab) + word_ids)
+    sentence_idx, word_idx = np.divmod(pairs, len(vocab))
+    
+    # A word co-occurs with every distinct word of each sentence it appears in
+    sentence_lengths = np.bincount(sentence_idx, minlength=len(sentences))
+    word_weights = np.zeros(len(vocab), dtype=np.float64)
+    np.add.at(word_weights, word_idx, sentence_lengths[sentence_idx] - 1)
+    
+    scores = np.zeros(len(sentences), dtype=np.float64)
+    np.add.at(scores, sentence_idx, word_weights[word_idx])
+    
+    # Highest scores first (stable on ties), then restore reading order
+    top = np.sort(np.argsort(-scores, kind='stable')[:k])
+    return [sentences[i] for i in top]
+
+
+def count_words(text, chunk_size=65536):
+    """
+    Count whitespace-separated words, equivalent to len(text.split())
+    
+    Splits the text in fixed-size chunks so a large document never
+    materializes its full word list.
+    
+    Args:
+        text: Text to count
+        chunk_size: Characters to split at a time
+        
+    Returns:
+        Number of words
+    """
+    count = 0
+    in_word = False
+    
+    for start in range(0, len(text), chunk_size):
+        chunk = text[start:start + chunk_size]
+        count += len(chunk.split())
+        # A word straddling the chunk boundary was counted twice
+        if in_word and not chunk[0].isspace():
+            count -= 1
+        in_word = not chunk[-1].isspace()
+    
+    return count
+
+
 def extract_key_concepts(text, max_concepts=20):
     """
     Extract potential key concepts, definitions, and important terms
@@ -187,9 +439,8 @@ def extract_key_concepts(text, max_concepts=20):
     """
     concepts = []
     
-    # Pattern: "X is defined as Y" or "X is Y"
-    definition_pattern = r'([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)\s+(?:is|are|refers to|means|defined as)\s+(.+?)(?:\.|;|\n)'
-    matches = re.finditer(definition_pattern, text)
+    # Definitions: "X is defined as Y" or "X is Y"
+    matches = _DEF_RE.finditer(text)
     
     for match in matches:
         term = match.group(1).strip()
@@ -200,9 +451,8 @@ def extract_key_concepts(text, max_concepts=20):
             'type': 'definition'
         })
     
-    # Pattern: Bullet points or numbered lists (often contain key points)
-    bullet_pattern = r'(?:^|\n)(?:[•\-\*]|\d+\.)\s+(.+?)(?:\n|$)'
-    bullet_matches = re.finditer(bullet_pattern, text)
+    # Bullet points or numbered lists (often contain key points)
+    bullet_matches = _BULLET_RE.finditer(text)
     
     for match in bullet_matches:
         point = match.group(1).strip()
@@ -222,5 +472,6 @@ if __name__ == "__main__":
     print("PDF Extractor Module - Ready")
     print("Functions available:")
     print("  - extract_text_from_pdf(filepath)")
+    print("  - extract_text_from_pdf_stream(stream)")
     print("  - clean_and_segment_text(raw_text)")
     print("  - extract_key_concepts(text)")
@@ -5,18 +5,689 @@ Handles AI-powered quiz question generation using OpenAI
 
 import os
 import json
+import logging
+import atexit
 import re
-from openai import OpenAI
+import time
+import asyncio
+import hashlib
+import functools
+import itertools
+import threading
+from collections import OrderedDict
+import httpx
+import ijson
+import numpy as np
+import tiktoken
+import ahocorasick
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 from dotenv import load_dotenv
 
+# Optional prompt compression (pip install llmlingua)
+try:
+    from llmlingua import PromptCompressor
+except ImportError:
+    PromptCompressor = None
+
+# File locks pick the one worker process that persists the semantic cache
+# (POSIX only; elsewhere the single dev server process always persists)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
 # Load environment variables
 load_dotenv()
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+# Initialize OpenAI client over one shared HTTP/2 connection pool, so
+# gathered generation and evaluation calls are multiplexed over a few
+# TLS connections instead of opening one each
+OPENAI_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+_http = DefaultAsyncHttpxClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+    timeout=OPENAI_TIMEOUT
+)
+
+# Rate limits (429), timeouts, 5xx and connection errors are retried by the
+# SDK with jittered exponential backoff before any caller falls back to
+# locally generated questions. The SDK applies its own per-request timeout,
+# so it is set here as well as on the HTTP client.
+OPENAI_MAX_RETRIES = 3
+client = AsyncOpenAI(
+    api_key=os.getenv('OPENAI_API_KEY'),
+    http_client=_http,
+    max_retries=OPENAI_MAX_RETRIES,
+    timeout=OPENAI_TIMEOUT
+)
+
+# Cap on in-flight OpenAI requests, to stay under the account's rate limits
+OPENAI_MAX_CONCURRENCY = int(os.getenv('OPENAI_MAX_CONCURRENCY', '16'))
+_openai_slots = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+
+# All OpenAI calls run on one long-lived event loop so the client's
+# connection pool is shared across requests and threads
+_loop = asyncio.new_event_loop()
+threading.Thread(target=_loop.run_forever, name='openai-loop', daemon=True).start()
+
+
+def _close_http_client():
+    """Close pooled connections on the event loop that owns them"""
+    try:
+        asyncio.run_coroutine_threadsafe(_http.aclose(), _loop).result(timeout=5)
+    except Exception:
+        log.exception("Error closing HTTP client")
+
+
+atexit.register(_close_http_client)
+
+
+# Token budget for the CONTENT block of generation prompts
+CONTENT_TOKEN_BUDGET = 1000
+
+# Model tiers: small easy quizzes go to the fastest model, large hard ones
+# to the strongest, everything else to the default
+FAST_MODEL = "gpt-4.1-nano"
+DEFAULT_MODEL = "gpt-4o-mini"
+STRONG_MODEL = "gpt-4o"
+GRADING_MODEL = DEFAULT_MODEL
+FAST_MODEL_MAX_QUESTIONS = 5
+FAST_MODEL_MAX_TOKENS = 500
+STRONG_MODEL_MIN_QUESTIONS = 10
+
+# Keyword scores at or beyond these bounds skip LLM grading
+KEYWORD_PASS_PERCENTAGE = 90
+KEYWORD_FAIL_PERCENTAGE = 10
+
+SYSTEM_PROMPT = "You are an expert educational content creator specializing in quiz generation."
+EVAL_SYSTEM_PROMPT = "You are an expert teacher evaluating student answers."
+
+# Prompt templates; only the per-request fields are substituted at call time
+_HINT_LINES = {True: "Include a hint for each question", False: "Do not include hints"}
+_REF_LINES = {True: "Include section references if applicable", False: "Do not include section references"}
+_ANSWER_STYLE_NOTES = {'full': "provide full model answers"}
+
+_MCQ_PROMPT = """You are an expert quiz generator. Based on the following educational content, create {num_questions} multiple-choice questions (MCQs).
+
+CONTENT:
+{content}
+
+REQUIREMENTS:
+- Difficulty level: {difficulty}
+- Distractor type: {distractor_type}
+- Each question should have 1 correct answer and 3 distractors (wrong answers)
+- {hint_line}
+- {ref_line}
+- If distractor_type is 'exam-style' or 'traps', include plausible wrong answers that test common misconceptions
+
+Generate {num_questions} questions and return them by calling emit_questions."""
+
+_SAQ_PROMPT = """You are an expert quiz generator. Based on the following educational content, create {num_questions} short answer questions (SAQs).
+
+CONTENT:
+{content}
+
+REQUIREMENTS:
+- Difficulty level: {difficulty}
+- Answer style: {answer_style} ({answer_style_note})
+- Each question should test understanding, not just memorization
+- {hint_line}
+- {ref_line}
+- Identify 3-7 key keywords that must appear in a correct answer
+- Provide marking points
+
+Generate {num_questions} questions and return them by calling emit_questions."""
+
+_MIXED_PROMPT = """You are an expert quiz generator. Based on the following educational content, create {num_mcq} multiple-choice questions (MCQs) and {num_saq} short answer questions (SAQs).
+
+CONTENT:
+{content}
+
+REQUIREMENTS:
+- Difficulty level: {difficulty}
+- {hint_line}
+- {ref_line}
+
+MCQ REQUIREMENTS:
+- Distractor type: {distractor_type}
+- Each question should have 1 correct answer and 3 distractors (wrong answers)
+- If distractor_type is 'exam-style' or 'traps', include plausible wrong answers that test common misconceptions
+
+SAQ REQUIREMENTS:
+- Answer style: {answer_style} ({answer_style_note})
+- Each question should test understanding, not just memorization
+- Identify 3-7 key keywords that must appear in a correct answer
+- Provide marking points
+
+Generate exactly {num_mcq} MCQs and {num_saq} SAQs and return them by calling emit_questions."""
+
+_EVAL_PROMPT = """Evaluate this student's answer compared to the model answer.
+
+MODEL ANSWER:
+{model_answer}
+
+STUDENT'S ANSWER:
+{user_answer}
+
+KEYWORDS REQUIRED: {keywords}
+
+Provide:
+1. A score out of 10
+2. Brief feedback on what was good
+3. What was missing or could be improved
+4. Whether the answer demonstrates understanding
+
+Respond in JSON format:
+{{
+  "score_out_of_10": 8,
+  "feedback": "Good understanding shown...",
+  "strengths": ["Point 1", "Point 2"],
+  "improvements": ["Missing X", "Could elaborate on Y"],
+  "demonstrates_understanding": true
+}}"""
+
+
+# Strict JSON schemas for the emit_questions tool; the model can only emit
+# the declared fields, so responses need no shape checking
+_MCQ_ITEM_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "type": {"type": "string", "enum": ["mcq"]},
+        "question": {"type": "string"},
+        "options": {"type": "array", "items": {"type": "string"}, "description": "Exactly 4 options"},
+        "correct_answer": {"type": "integer", "description": "Index of the correct option (0-3)"},
+        "explanation": {"type": "string", "description": "Brief explanation of why this is correct"},
+        "hint": {"type": "string", "description": "Hint, or empty string if hints are not wanted"},
+        "section_reference": {"type": "string", "description": "Section number or topic, or empty string"},
+        "difficulty": {"type": "string"}
+    },
+    "required": ["type", "question", "options", "correct_answer", "explanation", "hint", "section_reference", "difficulty"],
+    "additionalProperties": False
+}
+
+_SAQ_ITEM_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "type": {"type": "string", "enum": ["saq"]},
+        "question": {"type": "string"},
+        "model_answer": {"type": "string", "description": "Complete model answer with all key points"},
+        "keywords": {"type": "array", "items": {"type": "string"}, "description": "3-7 keywords a correct answer must contain"},
+        "marking_points": {"type": "array", "items": {"type": "string"}},
+        "hint": {"type": "string", "description": "Hint, or empty string if hints are not wanted"},
+        "section_reference": {"type": "string", "description": "Section number or topic, or empty string"},
+        "difficulty": {"type": "string"},
+        "max_marks": {"type": "integer"}
+    },
+    "required": ["type", "question", "model_answer", "keywords", "marking_points", "hint", "section_reference", "difficulty", "max_marks"],
+    "additionalProperties": False
+}
+
+MCQ_SCHEMA = {
+    "type": "object",
+    "properties": {"questions": {"type": "array", "items": _MCQ_ITEM_SCHEMA}},
+    "required": ["questions"],
+    "additionalProperties": False
+}
+
+SAQ_SCHEMA = {
+    "type": "object",
+    "properties": {"questions": {"type": "array", "items": _SAQ_ITEM_SCHEMA}},
+    "required": ["questions"],
+    "additionalProperties": False
+}
+
+MIXED_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "mcq_questions": {"type": "array", "items": _MCQ_ITEM_SCHEMA},
+        "saq_questions": {"type": "array", "items": _SAQ_ITEM_SCHEMA}
+    },
+    "required": ["mcq_questions", "saq_questions"],
+    "additionalProperties": False
+}
+
+
+def _emit_questions_tools(schema):
+    """Wrap a schema as the single emit_questions tool"""
+    return [{
+        "type": "function",
+        "function": {
+            "name": "emit_questions",
+            "description": "Return the generated quiz questions",
+            "strict": True,
+            "parameters": schema
+        }
+    }]
+
+
+MCQ_TOOLS = _emit_questions_tools(MCQ_SCHEMA)
+SAQ_TOOLS = _emit_questions_tools(SAQ_SCHEMA)
+MIXED_TOOLS = _emit_questions_tools(MIXED_SCHEMA)
+EMIT_QUESTIONS_CHOICE = {"type": "function", "function": {"name": "emit_questions"}}
+
+# Tokenizer for prompt budgeting; loading it may need network access on first
+# use, so fall back to a character estimate if it is unavailable
+try:
+    _ENC = tiktoken.encoding_for_model("gpt-4o-mini")
+except Exception as e:
+    log.warning("tiktoken encoding unavailable, using character budget: %s", e)
+    _ENC = None
+
+
+# Characters of text encoded per token of budget before falling back to
+# encoding the whole text; English averages about 4 characters per token
+PRE_SLICE_CHARS_PER_TOKEN = 8
+
+
+def _count_tokens(text):
+    """Count tokens in text, estimating if the tokenizer is unavailable"""
+    if _ENC is None:
+        return len(text) // 4 + 1
+    return len(_ENC.encode(text, disallowed_special=()))
+
+
+def _fit_to_token_budget(text, budget=CONTENT_TOKEN_BUDGET):
+    """Truncate text to at most budget tokens"""
+    # Every token covers at least one UTF-8 byte, so shorter text always fits
+    if len(text) <= budget and len(text.encode('utf-8')) <= budget:
+        return text
+    
+    if _ENC is None:
+        return text[:budget * 4]  # ~4 characters per token
+    
+    # Only the head of the text can end up in the prompt, so encode a slice
+    # of it; encode everything only if the slice turns out to fit
+    head = text[:budget * PRE_SLICE_CHARS_PER_TOKEN]
+    ids = _ENC.encode(head, disallowed_special=())
+    if len(ids) <= budget and len(head) < len(text):
+        ids = _ENC.encode(text, disallowed_special=())
+    
+    if len(ids) <= budget:
+        return text
+    
+    return _ENC.decode(ids[:budget])
+
+
+# Tokens each prompt template adds around the content, counted once here.
+# Every prompt is held to the size of the largest (mixed) one, so single
+# type prompts can fit a little more content.
+_MCQ_OVERHEAD = _count_tokens(SYSTEM_PROMPT) + _count_tokens(_MCQ_PROMPT.format(
+    content='', num_questions=10, difficulty='medium', distractor_type='exam-style',
+    hint_line=_HINT_LINES[True], ref_line=_REF_LINES[True]
+))
+_SAQ_OVERHEAD = _count_tokens(SYSTEM_PROMPT) + _count_tokens(_SAQ_PROMPT.format(
+    content='', num_questions=10, difficulty='medium', answer_style='full',
+    answer_style_note=_ANSWER_STYLE_NOTES['full'], hint_line=_HINT_LINES[True], ref_line=_REF_LINES[True]
+))
+_MIXED_OVERHEAD = _count_tokens(SYSTEM_PROMPT) + _count_tokens(_MIXED_PROMPT.format(
+    content='', num_mcq=5, num_saq=5, difficulty='medium', distractor_type='exam-style', answer_style='full',
+    answer_style_note=_ANSWER_STYLE_NOTES['full'], hint_line=_HINT_LINES[True], ref_line=_REF_LINES[True]
+))
+PROMPT_TOKEN_BUDGET = CONTENT_TOKEN_BUDGET + _MIXED_OVERHEAD
+
+
+# Smallest share of the content budget given to one segment's summary
+SEGMENT_SUMMARY_MIN_TOKENS = 50
+
+
+def _prompt_content(text, segments):
+    """
+    Pick the notes content to send in generation prompts
+    
+    Text that fits the content budget and covers the whole document is
+    sent as is. Otherwise (long notes would be cut to their opening pages,
+    and the upload endpoint only returns a preview of the text) the
+    segments' summary sentences are sent instead, each under its heading
+    with an equal share of the budget.
+    
+    Args:
+        text: Full text content, or a preview of it
+        segments: Content segments, with 'summary_sentences' from upload
+        
+    Returns:
+        Content text for the prompt
+    """
+    summarized = [s for s in segments if s.get('summary_sentences')]
+    if not summarized:
+        return text
+    
+    covers_segments = len(text) >= sum(len(s.get('content') or '') for s in segments)
+    if covers_segments and _fit_to_token_budget(text) == text:
+        return text
+    
+    share = max(CONTENT_TOKEN_BUDGET // len(summarized), SEGMENT_SUMMARY_MIN_TOKENS)
+    parts = []
+    for segment in summarized:
+        summary = _fit_to_token_budget(' '.join(segment['summary_sentences']), share)
+        parts.append(f"{segment['heading']}\n{summary}" if segment.get('heading') else summary)
+    
+    return '\n\n'.join(parts)
 
 
-def generate_quiz(text, segments, preferences):
+def _pick_model(difficulty, n, n_tokens):
+    """
+    Pick the model tier for a generation request
+    
+    Args:
+        difficulty: Quiz difficulty ('easy', 'medium' or 'hard')
+        n: Number of questions requested
+        n_tokens: Approximate token length of the content sent
+        
+    Returns:
+        Model name
+    """
+    if difficulty == 'easy' and n <= FAST_MODEL_MAX_QUESTIONS and n_tokens <= FAST_MODEL_MAX_TOKENS:
+        return FAST_MODEL
+    if difficulty == 'hard' and n >= STRONG_MODEL_MIN_QUESTIONS:
+        return STRONG_MODEL
+    return DEFAULT_MODEL
+
+# LLMLingua-2 compressor, loaded on first use since the model is large
+COMPRESSION_MODEL = "microsoft/llmlingua-2-bert-base-multilingual-cased-meetingbank"
+_compressor = None
+_compressor_lock = threading.Lock()
+
+
+def _compress_content(text, target_token=CONTENT_TOKEN_BUDGET):
+    """
+    Compress text with LLMLingua so more of the notes fit in the token budget
+    
+    Args:
+        text: Full text content
+        target_token: Token count to compress towards
+        
+    Returns:
+        Compressed text, or the original text if compression is unavailable
+    """
+    global _compressor
+    
+    if PromptCompressor is None:
+        log.warning("llmlingua is not installed, skipping prompt compression")
+        return text
+    
+    try:
+        with _compressor_lock:
+            if _compressor is None:
+                _compressor = PromptCompressor(model_name=COMPRESSION_MODEL, use_llmlingua2=True, device_map="cpu")
+            result = _compressor.compress_prompt(text, target_token=target_token, force_tokens=['\n', '?'])
+        return result["compressed_prompt"]
+    except Exception:
+        log.exception("Error compressing prompt")
+        return text
+
+
+# Exact-prompt response cache for deterministic (temperature 0) requests:
+# key -> (expires_at, content), least recently used first
+LLM_CACHE_TTL = 3600
+LLM_CACHE_MAX_ENTRIES = 1024
+_llm_cache = OrderedDict()
+
+
+def _llm_cache_get(key):
+    """Return cached content for key, or None if missing or expired"""
+    entry = _llm_cache.get(key)
+    if entry is None:
+        return None
+    
+    expires_at, content = entry
+    if expires_at < time.monotonic():
+        del _llm_cache[key]
+        return None
+    
+    _llm_cache.move_to_end(key)
+    return content
+
+
+def _llm_cache_set(key, content):
+    """Cache content for key, evicting the least recently used entries"""
+    _llm_cache[key] = (time.monotonic() + LLM_CACHE_TTL, content)
+    _llm_cache.move_to_end(key)
+    while len(_llm_cache) > LLM_CACHE_MAX_ENTRIES:
+        _llm_cache.popitem(last=False)
+
+
+async def _chat_completion(messages, temperature, response_format=None, model=DEFAULT_MODEL, tools=None, tool_choice=None):
+    """
+    Create a chat completion and return the message content
+    
+    When tools are given, the arguments of the first tool call are returned
+    instead. Temperature 0 requests are deterministic, so they are served
+    from an exact-match cache keyed on the full request.
+    """
+    request = {
+        'model': model,
+        'messages': messages,
+        'temperature': temperature
+    }
+    if response_format is not None:
+        request['response_format'] = response_format
+    if tools is not None:
+        request['tools'] = tools
+        request['tool_choice'] = tool_choice
+    
+    key = None
+    if temperature == 0:
+        key = hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+        
+        content = _llm_cache_get(key)
+        if content is not None:
+            return content
+    
+    async with _openai_slots:
+        response = await client.chat.completions.create(**request)
+    message = response.choices[0].message
+    if tools is not None:
+        content = message.tool_calls[0].function.arguments
+    else:
+        content = message.content
+    
+    if key is not None:
+        _llm_cache_set(key, content)
+    
+    return content
+
+
+# Semantic cache for SAQ grading: answers whose embeddings are this similar
+# to a previously graded one reuse its evaluation
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIMENSIONS = 1536
+SEMANTIC_CACHE_THRESHOLD = 0.95
+
+
+class SemanticCache:
+    """
+    Embedding-similarity cache of SAQ gradings
+    
+    Stores L2-normalized embeddings of (model answer, user answer) pairs
+    alongside their AI evaluations in a fixed-size ring buffer, persisted
+    as a single .npz file that is replaced atomically.
+    
+    With several server worker processes, only the one holding the .lock
+    file writes the cache file; the others start from the saved entries
+    and keep their own additions in memory.
+    """
+    
+    def __init__(self, path='semantic_cache', max_entries=5000, save_every=20):
+        self.cache_file = f"{path}.npz"
+        self.max_entries = max_entries
+        self.save_every = save_every
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        # Ring buffer: the next entry is written at _next, overwriting the
+        # oldest once all max_entries rows are used
+        self.embeddings = np.zeros((max_entries, EMBEDDING_DIMENSIONS), dtype=np.float32)
+        self.evaluations = [None] * max_entries
+        self._count = 0
+        self._next = 0
+        self._load()
+        self.persist = self._acquire_writer_lock(f"{path}.lock")
+        if self.persist:
+            atexit.register(self.save)
+    
+    def _acquire_writer_lock(self, lock_path):
+        """Try to become the process that persists the cache"""
+        if fcntl is None:
+            return True
+        
+        try:
+            self._lock_file = open(lock_path, 'w')
+        except OSError:
+            return False
+        
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            self._lock_file.close()
+            return False
+    
+    def _load(self):
+        """Load persisted entries, starting empty if missing or inconsistent"""
+        try:
+            with np.load(self.cache_file) as data:
+                embeddings = data['embeddings']
+                evaluations = json.loads(str(data['evaluations']))
+        except (OSError, ValueError, KeyError):
+            return
+        
+        if len(evaluations) != len(embeddings) or embeddings.shape[1:] != (EMBEDDING_DIMENSIONS,):
+            return
+        
+        n = min(len(evaluations), self.max_entries)
+        if n:
+            self.embeddings[:n] = embeddings[-n:]
+            self.evaluations[:n] = evaluations[-n:]
+        self._count = n
+        self._next = n % self.max_entries
+    
+    def _snapshot(self):
+        """Copy the entries, oldest first"""
+        with self._lock:
+            if self._count < self.max_entries:
+                return self.embeddings[:self._count].copy(), self.evaluations[:self._count]
+            
+            order = np.r_[self._next:self.max_entries, 0:self._next]
+            return self.embeddings[order], self.evaluations[self._next:] + self.evaluations[:self._next]
+    
+    def save(self):
+        """Persist entries to disk (blocking; add() runs it off the event loop)"""
+        if not self.persist:
+            return
+        
+        embeddings, evaluations = self._snapshot()
+        with self._save_lock:
+            # Write then rename so readers never see a partial file
+            tmp_path = f"{self.cache_file}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, 'wb') as f:
+                    np.savez(f, embeddings=embeddings, evaluations=np.array(json.dumps(evaluations)))
+                os.replace(tmp_path, self.cache_file)
+            except OSError:
+                log.exception("Error saving semantic cache")
+    
+    def lookup(self, embedding, threshold=None):
+        """
+        Return the evaluation of the most similar cached answer above threshold
+        
+        The threshold can only be raised above SEMANTIC_CACHE_THRESHOLD, since
+        it may come from the client and a low one would hand out the grade of
+        a different answer.
+        """
+        if embedding is None or not self._count:
+            return None
+        
+        if threshold is None:
+            threshold = SEMANTIC_CACHE_THRESHOLD
+        else:
+            threshold = max(float(threshold), SEMANTIC_CACHE_THRESHOLD)
+        
+        with self._lock:
+            sims = self.embeddings[:self._count] @ embedding
+            best = int(np.argmax(sims))
+            return self.evaluations[best] if sims[best] > threshold else None
+    
+    async def add(self, embedding, evaluation):
+        """Cache an evaluation, overwriting the oldest entry once full"""
+        if embedding is None:
+            return
+        
+        with self._lock:
+            self.embeddings[self._next] = embedding
+            self.evaluations[self._next] = evaluation
+            self._next = (self._next + 1) % self.max_entries
+            self._count = min(self._count + 1, self.max_entries)
+            
+            self._unsaved += 1
+            save_due = self.persist and self._unsaved >= self.save_every
+            if save_due:
+                self._unsaved = 0
+        
+        # Writing the file takes tens of milliseconds at capacity; keep it
+        # off the event loop shared by every OpenAI call
+        if save_due:
+            await asyncio.to_thread(self.save)
+
+
+async def _embed_answer(model_answer, user_answer):
+    """Embed a (model answer, user answer) pair as an L2-normalized vector, or None on failure"""
+    try:
+        async with _openai_slots:
+            response = await client.embeddings.create(
+                model=EMBEDDING_MODEL,
+                input=f"{model_answer}\n||\n{user_answer}"
+            )
+        vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+    except Exception:
+        log.exception("Error embedding answer")
+        return None
+
+
+semantic_cache = SemanticCache()
+
+
+async def _anext(agen):
+    return await agen.__anext__()
+
+
+def iter_sync(agen):
+    """
+    Iterate an async generator on the shared event loop from synchronous
+    code, one item at a time
+    """
+    try:
+        while True:
+            try:
+                yield run_sync(_anext(agen))
+            except StopAsyncIteration:
+                return
+    finally:
+        run_sync(agen.aclose())
+
+
+def run_sync(coro):
+    """
+    Run a coroutine from this module on the shared event loop and wait
+    for its result (for use from synchronous code such as Flask views)
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _loop).result()
+
+
+def _question_counts(question_type, num_questions):
+    """Split the requested number of questions into (num_mcq, num_saq)"""
+    if question_type == 'mcq':
+        return num_questions, 0
+    if question_type == 'saq':
+        return 0, num_questions
+    # mixed
+    num_mcq = num_questions // 2
+    return num_mcq, num_questions - num_mcq
+
+
+async def generate_quiz(text, segments, preferences, stream=False):
     """
     Generate quiz questions based on text content and user preferences
     
@@ -24,9 +695,14 @@ def generate_quiz(text, segments, preferences):
         text: Full text content
         segments: List of content segments with headings
         preferences: Dictionary with quiz preferences
+        stream: Return questions as they are generated (not a preference,
+            since the result is then not JSON-serializable)
         
     Returns:
-        Dictionary containing quiz data with questions
+        Dictionary containing quiz data with questions, with 'fallback' set
+        if any were generated locally after an API failure. With stream set,
+        'questions' is replaced by 'questions_iter', an async iterator of
+        questions (see iter_sync for synchronous callers)
     """
     # Extract preferences with defaults
     question_type = preferences.get('question_type', 'mixed')
@@ -36,151 +712,339 @@ def generate_quiz(text, segments, preferences):
     saq_answer_style = preferences.get('saq_answer_style', 'full')
     include_hints = preferences.get('include_hints', True)
     include_section_refs = preferences.get('include_section_refs', True)
+    parallel_generation = preferences.get('parallel_generation', False)
+    # Cache mode makes generation deterministic so repeat requests hit the
+    # LLM response cache
+    temperature = 0 if preferences.get('cache_mode') else 0.7
     
-    # Determine question distribution
-    if question_type == 'mcq':
-        num_mcq = num_questions
-        num_saq = 0
-    elif question_type == 'saq':
-        num_mcq = 0
-        num_saq = num_questions
-    else:  # mixed
-        num_mcq = num_questions // 2
-        num_saq = num_questions - num_mcq
+    num_mcq, num_saq = _question_counts(question_type, num_questions)
+    
+    # Compress the notes once and share the result between both question
+    # types; worth the CPU cost only when it is reused across questions
+    content = _prompt_content(text, segments)
+    if preferences.get('compress_prompt') and num_mcq + num_saq >= 2 and _fit_to_token_budget(content) != content:
+        content = await asyncio.to_thread(_compress_content, content)
+    
+    # Content is capped at the token budget; ~4 characters per token is
+    # close enough for choosing a model tier
+    model = _pick_model(difficulty, num_questions, min(len(content) // 4, CONTENT_TOKEN_BUDGET))
+    
+    # Streaming consumers get each question as soon as the model emits it
+    if stream:
+        return _quiz_result(text, segments, preferences, {
+            'questions_iter': stream_questions(content, segments, num_mcq, num_saq, difficulty, mcq_distractor_type, saq_answer_style, include_hints, include_section_refs, temperature, model)
+        })
     
     questions = []
     
+    # Mixed quizzes, latency first: MCQ and SAQ requests run concurrently
+    if num_mcq > 0 and num_saq > 0 and parallel_generation:
+        mcqs, saqs = await asyncio.gather(
+            generate_mcqs(content, segments, num_mcq, difficulty, mcq_distractor_type, include_hints, include_section_refs, temperature, model),
+            generate_saqs(content, segments, num_saq, difficulty, saq_answer_style, include_hints, include_section_refs, temperature, model)
+        )
+        questions.extend(mcqs)
+        questions.extend(saqs)
+    
+    # Mixed quizzes: one request for both question types, so the content
+    # is only sent once
+    elif num_mcq > 0 and num_saq > 0:
+        mcqs, saqs = await generate_mixed(content, segments, num_mcq, num_saq, difficulty, mcq_distractor_type, saq_answer_style, include_hints, include_section_refs, temperature, model)
+        questions.extend(mcqs)
+        questions.extend(saqs)
+    
     # Generate MCQs
-    if num_mcq > 0:
-        mcqs = generate_mcqs(text, segments, num_mcq, difficulty, mcq_distractor_type, include_hints, include_section_refs)
+    elif num_mcq > 0:
+        mcqs = await generate_mcqs(content, segments, num_mcq, difficulty, mcq_distractor_type, include_hints, include_section_refs, temperature, model)
         questions.extend(mcqs)
     
     # Generate SAQs
-    if num_saq > 0:
-        saqs = generate_saqs(text, segments, num_saq, difficulty, saq_answer_style, include_hints, include_section_refs)
+    elif num_saq > 0:
+        saqs = await generate_saqs(content, segments, num_saq, difficulty, saq_answer_style, include_hints, include_section_refs, temperature, model)
         questions.extend(saqs)
     
-    return {
+    return _quiz_result(text, segments, preferences, {
         'questions': questions,
         'total_questions': len(questions),
-        'preferences': preferences,
-        'text': text,
-        'segments': segments
-    }
+        # Set when the API failed and questions were generated locally (or
+        # none could be), so callers can avoid caching the degraded quiz
+        'fallback': not questions or any(q.get('fallback') for q in questions)
+    })
 
 
-def generate_mcqs(text, segments, num_questions, difficulty, distractor_type, include_hints, include_section_refs):
-    """Generate Multiple Choice Questions using AI"""
+def _quiz_result(text, segments, preferences, result):
+    """
+    Add quiz metadata to a generation result
     
-    # Build prompt for OpenAI
-    prompt = f"""You are an expert quiz generator. Based on the following educational content, create {num_questions} multiple-choice questions (MCQs).
+    The input is identified by hash rather than echoed back, since it can
+    be far larger than the quiz; set the 'echo_input' preference to include
+    the text and segments as well.
+    """
+    result['preferences'] = preferences
+    result['text_hash'] = hashlib.sha1(text.encode('utf-8')).hexdigest()
+    result['num_segments'] = len(segments)
+    
+    if preferences.get('echo_input', False):
+        result['text'] = text
+        result['segments'] = segments
+    
+    return result
 
-CONTENT:
-{text[:4000]}  # Limit to avoid token issues
 
-REQUIREMENTS:
-- Difficulty level: {difficulty}
-- Distractor type: {distractor_type}
-- Each question should have 1 correct answer and 3 distractors (wrong answers)
-- {'Include a hint for each question' if include_hints else 'Do not include hints'}
-- {'Include section references if applicable' if include_section_refs else 'Do not include section references'}
-- If distractor_type is 'exam-style' or 'traps', include plausible wrong answers that test common misconceptions
+def _normalize_keywords(question):
+    """
+    Lowercase and de-duplicate an SAQ's keywords in place
+    
+    Keywords are normalized once when the question is generated, so grading
+    every submission does not have to.
+    """
+    if question.get('keywords'):
+        question['keywords'] = list(dict.fromkeys(k.lower() for k in question['keywords']))
+    return question
 
-OUTPUT FORMAT (JSON):
-{{
-  "questions": [
-    {{
-      "type": "mcq",
-      "question": "Question text?",
-      "options": ["Option A", "Option B", "Option C", "Option D"],
-      "correct_answer": 0,  // index of correct option (0-3)
-      "explanation": "Brief explanation of why this is correct",
-      "hint": "Optional hint",
-      "section_reference": "Section number or topic",
-      "difficulty": "{difficulty}"
-    }}
-  ]
-}}
-
-Generate {num_questions} questions in this exact format."""
 
+def _mcq_messages(text, num_questions, difficulty, distractor_type, include_hints, include_section_refs):
+    """Build the chat messages for an MCQ generation request"""
+    
+    excerpt = _fit_to_token_budget(text, PROMPT_TOKEN_BUDGET - _MCQ_OVERHEAD)
+    
+    prompt = _MCQ_PROMPT.format(
+        content=excerpt,
+        num_questions=num_questions,
+        difficulty=difficulty,
+        distractor_type=distractor_type,
+        hint_line=_HINT_LINES[bool(include_hints)],
+        ref_line=_REF_LINES[bool(include_section_refs)]
+    )
+
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+
+async def generate_mcqs(text, segments, num_questions, difficulty, distractor_type, include_hints, include_section_refs, temperature=0.7, model=DEFAULT_MODEL):
+    """Generate Multiple Choice Questions using AI"""
+    
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are an expert educational content creator specializing in quiz generation."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            response_format={"type": "json_object"}
+        arguments = await _chat_completion(
+            messages=_mcq_messages(text, num_questions, difficulty, distractor_type, include_hints, include_section_refs),
+            temperature=temperature,
+            model=model,
+            tools=MCQ_TOOLS,
+            tool_choice=EMIT_QUESTIONS_CHOICE
         )
         
-        result = json.loads(response.choices[0].message.content)
-        return result.get('questions', [])
+        result = json.loads(arguments)
+        return result['questions']
         
-    except Exception as e:
-        print(f"Error generating MCQs: {e}")
+    except Exception:
+        log.exception("Error generating MCQs")
         # Return fallback questions if API fails
         return generate_fallback_mcqs(text, num_questions, segments)
 
 
-def generate_saqs(text, segments, num_questions, difficulty, answer_style, include_hints, include_section_refs):
+def _saq_messages(text, num_questions, difficulty, answer_style, include_hints, include_section_refs):
+    """Build the chat messages for an SAQ generation request"""
+    
+    excerpt = _fit_to_token_budget(text, PROMPT_TOKEN_BUDGET - _SAQ_OVERHEAD)
+    
+    prompt = _SAQ_PROMPT.format(
+        content=excerpt,
+        num_questions=num_questions,
+        difficulty=difficulty,
+        answer_style=answer_style,
+        answer_style_note=_ANSWER_STYLE_NOTES.get(answer_style, 'provide keywords only'),
+        hint_line=_HINT_LINES[bool(include_hints)],
+        ref_line=_REF_LINES[bool(include_section_refs)]
+    )
+
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+
+async def generate_saqs(text, segments, num_questions, difficulty, answer_style, include_hints, include_section_refs, temperature=0.7, model=DEFAULT_MODEL):
     """Generate Short Answer Questions using AI"""
     
-    prompt = f"""You are an expert quiz generator. Based on the following educational content, create {num_questions} short answer questions (SAQs).
+    try:
+        arguments = await _chat_completion(
+            messages=_saq_messages(text, num_questions, difficulty, answer_style, include_hints, include_section_refs),
+            temperature=temperature,
+            model=model,
+            tools=SAQ_TOOLS,
+            tool_choice=EMIT_QUESTIONS_CHOICE
+        )
+        
+        result = json.loads(arguments)
+        return [_normalize_keywords(q) for q in result['questions']]
+        
+    except Exception:
+        log.exception("Error generating SAQs")
+        # Return fallback questions if API fails
+        return generate_fallback_saqs(text, num_questions, segments)
 
-CONTENT:
-{text[:4000]}
 
-REQUIREMENTS:
-- Difficulty level: {difficulty}
-- Answer style: {answer_style} ({'provide full model answers' if answer_style == 'full' else 'provide keywords only'})
-- Each question should test understanding, not just memorization
-- {'Include a hint for each question' if include_hints else 'Do not include hints'}
-- {'Include section references if applicable' if include_section_refs else 'Do not include section references'}
-- Identify 3-7 key keywords that must appear in a correct answer
-- Provide marking points
+def _mixed_messages(text, num_mcq, num_saq, difficulty, distractor_type, answer_style, include_hints, include_section_refs):
+    """Build the chat messages for a combined MCQ and SAQ request"""
+    
+    excerpt = _fit_to_token_budget(text, PROMPT_TOKEN_BUDGET - _MIXED_OVERHEAD)
+    
+    prompt = _MIXED_PROMPT.format(
+        content=excerpt,
+        num_mcq=num_mcq,
+        num_saq=num_saq,
+        difficulty=difficulty,
+        distractor_type=distractor_type,
+        answer_style=answer_style,
+        answer_style_note=_ANSWER_STYLE_NOTES.get(answer_style, 'provide keywords only'),
+        hint_line=_HINT_LINES[bool(include_hints)],
+        ref_line=_REF_LINES[bool(include_section_refs)]
+    )
 
-OUTPUT FORMAT (JSON):
-{{
-  "questions": [
-    {{
-      "type": "saq",
-      "question": "Question text?",
-      "model_answer": "Complete model answer with all key points",
-      "keywords": ["keyword1", "keyword2", "keyword3"],
-      "marking_points": ["Point 1", "Point 2", "Point 3"],
-      "hint": "Optional hint",
-      "section_reference": "Section number or topic",
-      "difficulty": "{difficulty}",
-      "max_marks": 5
-    }}
-  ]
-}}
-
-Generate {num_questions} questions in this exact format."""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
 
+
+async def generate_mixed(text, segments, num_mcq, num_saq, difficulty, distractor_type, answer_style, include_hints, include_section_refs, temperature=0.7, model=DEFAULT_MODEL):
+    """Generate MCQs and SAQs together in a single AI request"""
+    
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are an expert educational content creator specializing in quiz generation."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            response_format={"type": "json_object"}
+        arguments = await _chat_completion(
+            messages=_mixed_messages(text, num_mcq, num_saq, difficulty, distractor_type, answer_style, include_hints, include_section_refs),
+            temperature=temperature,
+            model=model,
+            tools=MIXED_TOOLS,
+            tool_choice=EMIT_QUESTIONS_CHOICE
         )
         
-        result = json.loads(response.choices[0].message.content)
-        return result.get('questions', [])
+        result = json.loads(arguments)
+        return result['mcq_questions'], [_normalize_keywords(q) for q in result['saq_questions']]
         
-    except Exception as e:
-        print(f"Error generating SAQs: {e}")
+    except Exception:
+        log.exception("Error generating mixed quiz")
         # Return fallback questions if API fails
-        return generate_fallback_saqs(text, num_questions, segments)
+        return (
+            generate_fallback_mcqs(text, num_mcq, segments),
+            generate_fallback_saqs(text, num_saq, segments)
+        )
 
 
-def evaluate_saq_answer(user_answer, model_answer, keywords):
+async def stream_questions(text, segments, num_mcq, num_saq, difficulty, distractor_type, answer_style, include_hints, include_section_refs, temperature=0.7, model=DEFAULT_MODEL):
+    """
+    Stream quiz generation and yield each question as soon as it is complete
+    
+    The tool call arguments are fed to incremental JSON parsers as they
+    arrive, so the first question is available long before the response
+    finishes. Mixed quizzes use the combined prompt.
+    
+    Yields:
+        Question dictionaries, MCQs first
+    """
+    if num_mcq > 0 and num_saq > 0:
+        messages = _mixed_messages(text, num_mcq, num_saq, difficulty, distractor_type, answer_style, include_hints, include_section_refs)
+        tools = MIXED_TOOLS
+        prefixes = ['mcq_questions.item', 'saq_questions.item']
+    elif num_mcq > 0:
+        messages = _mcq_messages(text, num_mcq, difficulty, distractor_type, include_hints, include_section_refs)
+        tools = MCQ_TOOLS
+        prefixes = ['questions.item']
+    elif num_saq > 0:
+        messages = _saq_messages(text, num_saq, difficulty, answer_style, include_hints, include_section_refs)
+        tools = SAQ_TOOLS
+        prefixes = ['questions.item']
+    else:
+        return
+    
+    # Questions yielded so far, by type
+    emitted = {'mcq': 0, 'saq': 0}
+    try:
+        # The slot is held until the stream is fully read, so long streams
+        # count against OPENAI_MAX_CONCURRENCY
+        async with _openai_slots:
+            stream = await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                tools=tools,
+                tool_choice=EMIT_QUESTIONS_CHOICE,
+                stream=True
+            )
+            
+            # One push parser per array; completed items land in `items`
+            items = ijson.sendable_list()
+            parsers = [ijson.items_coro(items, prefix, use_float=True) for prefix in prefixes]
+            
+            async for chunk in stream:
+                if not chunk.choices or not chunk.choices[0].delta.tool_calls:
+                    continue
+                
+                arguments = chunk.choices[0].delta.tool_calls[0].function.arguments
+                if not arguments:
+                    continue
+                
+                data = arguments.encode('utf-8')
+                for parser in parsers:
+                    parser.send(data)
+                for question in items:
+                    emitted[question['type']] += 1
+                    yield _normalize_keywords(question)
+                del items[:]
+            
+            for parser in parsers:
+                parser.close()
+            for question in items:
+                emitted[question['type']] += 1
+                yield _normalize_keywords(question)
+        
+    except Exception:
+        log.exception("Error streaming questions after %d MCQs and %d SAQs", emitted['mcq'], emitted['saq'])
+        # Top up each question type with fallback questions if the stream
+        # fails part way
+        for question in generate_fallback_mcqs(text, max(num_mcq - emitted['mcq'], 0), segments):
+            yield question
+        for question in generate_fallback_saqs(text, max(num_saq - emitted['saq'], 0), segments):
+            yield question
+
+
+@functools.lru_cache(maxsize=4096)
+def _keyword_automaton(keywords):
+    """
+    Build an Aho-Corasick automaton matching a question's keywords
+    
+    Keywords of newly generated questions are already lowercase; they are
+    still lowercased here (once per keyword set) for quizzes saved before
+    keywords were normalized.
+    
+    Args:
+        keywords: Sorted tuple of keywords (hashable, so automata are cached
+            per keyword set)
+        
+    Returns:
+        Automaton whose matches yield the original keywords for each
+        lowercased pattern, or None if there is nothing to match
+    """
+    originals = {}
+    for keyword in keywords:
+        originals.setdefault(keyword.lower(), []).append(keyword)
+    
+    automaton = ahocorasick.Automaton()
+    for word, matches in originals.items():
+        if word:
+            automaton.add_word(word, tuple(matches))
+    
+    # An automaton with no words cannot be finalized or searched
+    if len(automaton) == 0:
+        return None
+    
+    automaton.make_automaton()
+    return automaton
+
+
+async def evaluate_saq_answer(user_answer, model_answer, keywords, similarity_threshold=None):
     """
     Evaluate user's SAQ answer by comparing with model answer and keywords
     
@@ -188,68 +1052,67 @@ def evaluate_saq_answer(user_answer, model_answer, keywords):
         user_answer: User's submitted answer
         model_answer: Correct model answer
         keywords: List of essential keywords
+        similarity_threshold: Cosine similarity above which a cached grading
+            of a near-identical answer is reused (default and minimum
+            SEMANTIC_CACHE_THRESHOLD)
         
     Returns:
         Dictionary with evaluation results
     """
     user_answer_lower = user_answer.lower()
     
-    # Check which keywords are present
-    keywords_found = []
-    keywords_missing = []
+    # Check which keywords are present in a single pass over the answer
+    automaton = _keyword_automaton(tuple(sorted(keywords)))
+    found = set()
+    if automaton is not None:
+        for _, originals in automaton.iter(user_answer_lower):
+            found.update(originals)
     
-    for keyword in keywords:
-        if keyword.lower() in user_answer_lower:
-            keywords_found.append(keyword)
-        else:
-            keywords_missing.append(keyword)
+    keywords_found = [k for k in keywords if k in found]
+    keywords_missing = [k for k in keywords if k not in found]
     
     # Calculate score
     total_keywords = len(keywords)
     score = len(keywords_found) / total_keywords if total_keywords > 0 else 0
     score_percentage = int(score * 100)
     
-    # Use AI for more nuanced evaluation
-    try:
-        prompt = f"""Evaluate this student's answer compared to the model answer.
-
-MODEL ANSWER:
-{model_answer}
-
-STUDENT'S ANSWER:
-{user_answer}
-
-KEYWORDS REQUIRED: {', '.join(keywords)}
-
-Provide:
-1. A score out of 10
-2. Brief feedback on what was good
-3. What was missing or could be improved
-4. Whether the answer demonstrates understanding
-
-Respond in JSON format:
-{{
-  "score_out_of_10": 8,
-  "feedback": "Good understanding shown...",
-  "strengths": ["Point 1", "Point 2"],
-  "improvements": ["Missing X", "Could elaborate on Y"],
-  "demonstrates_understanding": true
-}}"""
-
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are an expert teacher evaluating student answers."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.3,
-            response_format={"type": "json_object"}
-        )
-        
-        ai_evaluation = json.loads(response.choices[0].message.content)
+    # A clear keyword pass or fail is graded from the keywords alone
+    ai_evaluation = None
+    clear_result = total_keywords > 0 and (
+        score_percentage >= KEYWORD_PASS_PERCENTAGE or score_percentage <= KEYWORD_FAIL_PERCENTAGE
+    )
+    
+    if not clear_result:
+        # Near-duplicate answers to the same question reuse an earlier grading
+        query_embedding = await _embed_answer(model_answer, user_answer)
+        ai_evaluation = semantic_cache.lookup(query_embedding, similarity_threshold)
         
-    except Exception as e:
-        print(f"Error in AI evaluation: {e}")
+        # Use AI for more nuanced evaluation
+        if ai_evaluation is None:
+            try:
+                prompt = _EVAL_PROMPT.format(
+                    model_answer=model_answer,
+                    user_answer=user_answer,
+                    keywords=', '.join(keywords)
+                )
+                
+                content = await _chat_completion(
+                    messages=[
+                        {"role": "system", "content": EVAL_SYSTEM_PROMPT},
+                        {"role": "user", "content": prompt}
+                    ],
+                    temperature=0,
+                    response_format={"type": "json_object"},
+                    model=GRADING_MODEL
+                )
+                
+                ai_evaluation = json.loads(content)
+                await semantic_cache.add(query_embedding, ai_evaluation)
+                
+            except Exception:
+                log.exception("Error in AI evaluation")
+    
+    if ai_evaluation is None:
         ai_evaluation = {
             "score_out_of_10": int(score * 10),
             "feedback": "Basic keyword matching performed.",
@@ -269,15 +1132,186 @@ Respond in JSON format:
     }
 
 
+async def evaluate_saq_batch(answers):
+    """
+    Evaluate several SAQ answers concurrently
+    
+    Args:
+        answers: List of dictionaries with user_answer, model_answer and keywords
+        
+    Returns:
+        List of evaluation results, in the same order as answers
+    """
+    return await asyncio.gather(*[
+        evaluate_saq_answer(
+            a.get('user_answer', ''),
+            a.get('model_answer', ''),
+            a.get('keywords', []),
+            a.get('similarity_threshold')
+        )
+        for a in answers
+    ])
+
+
+# Batch API settings for bulk, non-interactive quiz generation
+BATCH_COMPLETION_WINDOW = "24h"
+BATCH_POLL_INTERVAL = 60
+_BATCH_TERMINAL_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+
+
+def _batch_request(job):
+    """Build one Batch API request line for a quiz job"""
+    preferences = job.get('preferences', {})
+    num_mcq, num_saq = _question_counts(
+        preferences.get('question_type', 'mixed'),
+        preferences.get('num_questions', 10)
+    )
+    difficulty = preferences.get('difficulty', 'medium')
+    distractor_type = preferences.get('mcq_distractor_type', 'exam-style')
+    answer_style = preferences.get('saq_answer_style', 'full')
+    include_hints = preferences.get('include_hints', True)
+    include_section_refs = preferences.get('include_section_refs', True)
+    
+    content = _prompt_content(job['text'], job.get('segments', []))
+    model = _pick_model(difficulty, num_mcq + num_saq, min(len(content) // 4, CONTENT_TOKEN_BUDGET))
+    
+    if num_mcq > 0 and num_saq > 0:
+        messages = _mixed_messages(content, num_mcq, num_saq, difficulty, distractor_type, answer_style, include_hints, include_section_refs)
+        tools = MIXED_TOOLS
+    elif num_mcq > 0:
+        messages = _mcq_messages(content, num_mcq, difficulty, distractor_type, include_hints, include_section_refs)
+        tools = MCQ_TOOLS
+    else:
+        messages = _saq_messages(content, num_saq, difficulty, answer_style, include_hints, include_section_refs)
+        tools = SAQ_TOOLS
+    
+    return {
+        "custom_id": str(job['id']),
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": model,
+            "messages": messages,
+            "temperature": 0 if preferences.get('cache_mode') else 0.7,
+            "tools": tools,
+            "tool_choice": EMIT_QUESTIONS_CHOICE
+        }
+    }
+
+
+def _fallback_quiz(job):
+    """Generate questions locally for a job the batch did not answer"""
+    preferences = job.get('preferences', {})
+    num_mcq, num_saq = _question_counts(
+        preferences.get('question_type', 'mixed'),
+        preferences.get('num_questions', 10)
+    )
+    segments = job.get('segments', [])
+    
+    return (generate_fallback_mcqs(job['text'], num_mcq, segments) +
+            generate_fallback_saqs(job['text'], num_saq, segments))
+
+
+async def generate_quiz_batch(jobs, poll_interval=BATCH_POLL_INTERVAL):
+    """
+    Generate quizzes for many documents through the OpenAI Batch API
+    
+    Batch requests cost half as much as regular requests but may take up
+    to the completion window to finish, so this is meant for offline use.
+    
+    Args:
+        jobs: List of dicts with a unique 'id', 'text', and optional
+              'segments' and 'preferences' (same keys as generate_quiz)
+        poll_interval: Seconds between batch status checks
+        
+    Returns:
+        Dictionary mapping each job id to its quiz data
+    """
+    jobs_by_id = {str(job['id']): job for job in jobs}
+    # The Batch API rejects the whole input file on a repeated custom_id
+    if len(jobs_by_id) != len(jobs):
+        raise ValueError("Batch job ids must be unique")
+    lines = [json.dumps(_batch_request(job)) for job in jobs]
+    
+    batch_file = await client.files.create(
+        file=("quiz_batch.jsonl", "\n".join(lines).encode('utf-8')),
+        purpose="batch"
+    )
+    batch = await client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window=BATCH_COMPLETION_WINDOW
+    )
+    
+    while batch.status not in _BATCH_TERMINAL_STATUSES:
+        await asyncio.sleep(poll_interval)
+        batch = await client.batches.retrieve(batch.id)
+    
+    if batch.status != 'completed':
+        log.warning("Batch %s ended with status %s", batch.id, batch.status)
+    
+    # Expired or cancelled batches can still have partial output
+    questions_by_id = {}
+    if batch.output_file_id:
+        output = await client.files.content(batch.output_file_id)
+        for line in output.text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+                response = item.get('response') or {}
+                if response.get('status_code') != 200:
+                    continue
+                message = response['body']['choices'][0]['message']
+                result = json.loads(message['tool_calls'][0]['function']['arguments'])
+                if 'questions' in result:
+                    questions = result['questions']
+                else:
+                    questions = result['mcq_questions'] + result['saq_questions']
+                questions_by_id[item['custom_id']] = [_normalize_keywords(q) for q in questions]
+            except Exception:
+                log.exception("Error parsing batch result")
+    
+    quizzes = {}
+    for job_id, job in jobs_by_id.items():
+        questions = questions_by_id.get(job_id)
+        if questions is None:
+            questions = _fallback_quiz(job)
+        quizzes[job_id] = {
+            'questions': questions,
+            'total_questions': len(questions),
+            'preferences': job.get('preferences', {})
+        }
+    
+    return quizzes
+
+
+_SENT_SPLIT = re.compile(r'[.!?]+')
+
+
+def _important_sentences(text):
+    """Yield sentences of a useful length for fill-in-the-blank questions"""
+    start = 0
+    for match in _SENT_SPLIT.finditer(text):
+        sentence = text[start:match.start()].strip()
+        if 40 < len(sentence) < 200:
+            yield sentence
+        start = match.end()
+    
+    sentence = text[start:].strip()
+    if 40 < len(sentence) < 200:
+        yield sentence
+
+
 def generate_fallback_mcqs(text, num_questions, segments):
     """Generate basic MCQs without AI (fallback)"""
     questions = []
     
-    # Extract sentences that look like definitions or important facts
-    sentences = re.split(r'[.!?]+', text)
-    important_sentences = [s.strip() for s in sentences if len(s.strip()) > 40 and len(s.strip()) < 200]
+    # Extract sentences that look like definitions or important facts,
+    # stopping as soon as there are enough
+    important_sentences = itertools.islice(_important_sentences(text), num_questions)
     
-    for i, sentence in enumerate(important_sentences[:num_questions]):
+    for sentence in important_sentences:
         # Create a simple fill-in-the-blank style question
         words = sentence.split()
         if len(words) > 5:
@@ -294,7 +1328,8 @@ def generate_fallback_mcqs(text, num_questions, segments):
                 'explanation': f'The correct word is "{answer}"',
                 'hint': 'Think about the context',
                 'section_reference': segments[0]['heading'] if segments else 'Main Content',
-                'difficulty': 'medium'
+                'difficulty': 'medium',
+                'fallback': True
             })
     
     return questions
@@ -314,15 +1349,72 @@ def generate_fallback_saqs(text, num_questions, segments):
             'hint': 'Consider the main ideas discussed',
             'section_reference': segment.get('heading', ''),
             'difficulty': 'medium',
-            'max_marks': 5
+            'max_marks': 5,
+            'fallback': True
         })
     
     return questions
 
 
+def _batch_cli(argv=None):
+    """Command line entry point: generate quizzes for PDFs via the Batch API"""
+    import argparse
+    from pdf_extractor import extract_text_from_pdf, clean_and_segment_text
+    
+    parser = argparse.ArgumentParser(description="Generate quizzes for PDFs using the OpenAI Batch API")
+    parser.add_argument('pdfs', nargs='+', help="PDF files to generate quizzes for")
+    parser.add_argument('--question-type', default='mixed', choices=['mcq', 'saq', 'mixed'])
+    parser.add_argument('--num-questions', type=int, default=10)
+    parser.add_argument('--difficulty', default='medium', choices=['easy', 'medium', 'hard'])
+    parser.add_argument('--poll-interval', type=int, default=BATCH_POLL_INTERVAL)
+    parser.add_argument('-o', '--output', default='quiz_batch_results.json')
+    args = parser.parse_args(argv)
+    
+    preferences = {
+        'question_type': args.question_type,
+        'num_questions': args.num_questions,
+        'difficulty': args.difficulty
+    }
+    
+    jobs = []
+    # Paths rather than file names identify jobs, since PDFs in different
+    # directories can share a name
+    for path in dict.fromkeys(args.pdfs):
+        # One empty or unreadable PDF shouldn't abort the whole batch
+        try:
+            text = extract_text_from_pdf(path)
+        except Exception as e:
+            log.warning("Skipping %s: %s", path, e)
+            continue
+        jobs.append({
+            'id': path,
+            'text': text,
+            'segments': clean_and_segment_text(text),
+            'preferences': preferences
+        })
+    
+    if not jobs:
+        print("No text could be extracted from any of the PDFs")
+        return
+    
+    quizzes = run_sync(generate_quiz_batch(jobs, poll_interval=args.poll_interval))
+    with open(args.output, 'w') as f:
+        json.dump(quizzes, f, indent=2)
+    print(f"Saved {len(quizzes)} quizzes to {args.output}")
+
+
 if __name__ == "__main__":
-    print("Question Generator Module - Ready")
-    print("Note: Requires OPENAI_API_KEY in .env file")
-    print("Functions available:")
-    print("  - generate_quiz(text, segments, preferences)")
-    print("  - evaluate_saq_answer(user_answer, model_answer, keywords)")
+    import sys
+    
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        _batch_cli(sys.argv[2:])
+    else:
+        print("Question Generator Module - Ready")
+        print("Note: Requires OPENAI_API_KEY in .env file")
+        print("Functions available:")
+        print("  - generate_quiz(text, segments, preferences)")
+        print("  - generate_quiz_batch(jobs)")
+        print("  - evaluate_saq_answer(user_answer, model_answer, keywords)")
+        print("  - evaluate_saq_batch(answers)")
+        print("All of the above are coroutines; use run_sync() from synchronous code")
+        print("Bulk generation: python question_generator.py batch notes1.pdf notes2.pdf")
@@ -0,0 +1,12 @@
+"""
+WSGI entry point for production servers
+
+Run with:
+    gunicorn -w 4 -k gthread --threads 8 -b 0.0.0.0:5001 wsgi:app
+"""
+
+from app import app
+
+
+if __name__ == "__main__":
+    app.run(host='0.0.0.0', port=5001)
@@ -10,9 +10,11 @@ function App() {
   const [uploadedData, setUploadedData] = useState(null);
   const [quizData, setQuizData] = useState(null);
   const [userAnswers, setUserAnswers] = useState([]);
+  const [regenerating, setRegenerating] = useState(false);
 
   const handleUploadComplete = (data) => {
     setUploadedData(data);
+    setRegenerating(false);
     setCurrentStep('preferences');
   };
 
@@ -31,9 +33,11 @@ function App() {
     setUploadedData(null);
     setQuizData(null);
     setUserAnswers([]);
+    setRegenerating(false);
   };
 
   const handleRegenerateQuiz = () => {
+    setRegenerating(true);
     setCurrentStep('preferences');
     setQuizData(null);
     setUserAnswers([]);
@@ -82,6 +86,7 @@ function App() {
             {currentStep === 'preferences' && (
               <QuizPreferences
                 uploadedData={uploadedData}
+                regenerating={regenerating}
                 onGenerate={handleQuizGenerated}
                 onBack={() => setCurrentStep('upload')}
               />
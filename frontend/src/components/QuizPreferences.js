@@ -4,7 +4,7 @@ import './QuizPreferences.css';
 
 const API_URL = process.env.REACT_APP_API_URL || 'http://localhost:5001';
 
-function QuizPreferences({ uploadedData, onGenerate, onBack }) {
+function QuizPreferences({ uploadedData, regenerating, onGenerate, onBack }) {
   const [preferences, setPreferences] = useState({
     question_type: 'mixed',
     num_questions: 10,
@@ -30,6 +30,9 @@ function QuizPreferences({ uploadedData, onGenerate, onBack }) {
         text: uploadedData.raw_text,
         segments: uploadedData.segments,
         preferences: preferences,
+        // A fresh nonce bypasses the server's quiz cache, so regenerating
+        // gives new questions instead of the previous quiz
+        ...(regenerating && { nonce: Date.now().toString(36) + Math.random().toString(36).slice(2) }),
       });
 
       if (response.data.success) {